@@ -4,28 +4,91 @@ FastAPI Backend with Web Speech API (frontend) and Database-driven Menu
 """
 
 import os
-import json
+import re
+import sys
+import asyncio
+import queue
+import atexit
+import logging
+import logging.handlers
 import sqlite3
-import difflib
+import heapq
+import functools
+import threading
+import orjson
+from collections import OrderedDict
+from types import MappingProxyType
 from datetime import datetime, timedelta, timezone
 from typing import Optional, List
-from contextlib import asynccontextmanager
-
-from fastapi import FastAPI, HTTPException
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass
+
+try:
+    import ahocorasick
+except ImportError:  # Fall back to bytes-level substring search
+    ahocorasick = None
+from rapidfuzz import fuzz, process
+from fastapi import FastAPI, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, TypeAdapter
 
 # ============ Configuration ============
 # ============ Configuration ============
 DATABASE_PATH = "orders.sqlite"
 THAI_TZ = timezone(timedelta(hours=7))
+COMMIT_BATCH_MAX = 64   # Max confirmed orders written per group commit
+
+# ============ Logging (written to stdout by a background thread) ============
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+logger.propagate = False
+_log_queue = queue.SimpleQueue()
+logger.addHandler(logging.handlers.QueueHandler(_log_queue))
+_log_stream_handler = logging.StreamHandler(sys.stdout)
+_log_stream_handler.setFormatter(logging.Formatter("%(levelname)s: %(message)s"))
+_log_listener = logging.handlers.QueueListener(_log_queue, _log_stream_handler)
+_log_listener.start()
+atexit.register(_log_listener.stop)
+
+def _fmt_ts(dt) -> str:
+    """Format datetime as 'YYYY-MM-DD HH:MM:SS' (cheaper than strftime)"""
+    return f"{dt.year:04d}-{dt.month:02d}-{dt.day:02d} {dt.hour:02d}:{dt.minute:02d}:{dt.second:02d}"
+
+def _fmt_date(d) -> str:
+    """Format date/datetime as 'YYYY-MM-DD' (cheaper than strftime)"""
+    return f"{d.year:04d}-{d.month:02d}-{d.day:02d}"
 
 # ============ Menu Cache (Loaded from DB on startup) ============
 MENU_CACHE = {
-    "items": [],           # List of all menu items
-    "keywords_map": {},    # keyword -> menu_item mapping for fast lookup
-    "last_updated": None
+    "items": (),           # All active menu items (immutable between reloads)
+    "names": (),           # Names of active items (for fuzzy suggestions)
+    "by_name": {},         # normalize_text(name) -> active item (fast path)
+    "inactive_by_name": {},  # normalize_text(name) -> inactive item (fast sold-out check)
+    "inactive_items": (),  # Inactive (sold-out) items
+    "keyword_index": None,           # Keyword matcher over active items (see build_keyword_index)
+    "inactive_keyword_index": None,  # Same for inactive (sold-out) items
+    "last_updated": None,
+    "version": 0,          # Bumped on every reload
+    "parse": None          # Memoized parser bound to this snapshot (set by reload_menu_cache)
 }
+_MENU_RELOAD_LOCK = threading.Lock()  # Serializes reloads (read + build + swap), so the newest DB state wins
+
+# ============ Pending Orders (In-memory for kitchen display) ============
+PENDING_ORDERS = OrderedDict()  # order_id -> order dict, oldest first
+PENDING_LOCK = threading.Lock()  # Writers take it inside db_session() (DB lock first, never the reverse)
+
+# ============ Orders Page Cache (invalidated on every order write) ============
+_ORDERS_VERSION = 0   # Bumped on insert/status change/delete; part of the page cache key
+
+def _bump_orders_version():
+    """Invalidate cached order pages (call after committing an order write)"""
+    global _ORDERS_VERSION
+    _ORDERS_VERSION += 1
+
+# ============ Group Commit (concurrent confirmations share one commit) ============
+_COMMIT_QUEUE: Optional[asyncio.Queue] = None   # (items, total_price, future); None = not running
+_COMMIT_TASK: Optional[asyncio.Task] = None
 
 # ============ Default Menu Data (for initial DB population) ============
 DEFAULT_MENU_ITEMS = [
@@ -93,21 +156,29 @@ DEFAULT_MENU_ITEMS = [
     {"name": "ผัดคะน้าหมูกรอบ", "keywords": "คะน้า,ผัดคะน้า,หมูกรอบ", "base_price": 80, "category": "kapkhao"},
 ]
 
-# Add-on options (still in code as they're fixed)
-ADD_ONS = {
+# Add-on options (still in code as they're fixed; read-only)
+ADD_ONS = MappingProxyType({
     "ไข่ดาว": {"price": 10, "emoji": "🍳"},
     "ไข่เจียว": {"price": 10, "emoji": "🥚"},
     "พิเศษ": {"price": 10, "emoji": "⭐"},
     "กับข้าว": {"price": 10, "emoji": "🍲"},
     "เพิ่มข้าว": {"price": 5, "emoji": "🍚"},
-}
+})
 
-THAI_NUMBERS = {
+# Finds every add-on name in one pass (longest names first)
+ADDON_RE = re.compile("|".join(re.escape(name) for name in sorted(ADD_ONS, key=len, reverse=True)))
+GAP_KHAO_PRICE = ADD_ONS["กับข้าว"]["price"]
+ADDONS_EXCLUDING_GAPKHAO = tuple((name, info["price"]) for name, info in ADD_ONS.items() if name != "กับข้าว")
+
+# Filler/polite words stripped before keyword scoring (one regex pass)
+FILLER_RE = re.compile("เอา|ขอ|หน่อย|ครับ")
+
+THAI_NUMBERS = MappingProxyType({
     "หนึ่ง": 1, "สอง": 2, "สาม": 3, "สี่": 4, "ห้า": 5,
     "หก": 6, "เจ็ด": 7, "แปด": 8, "เก้า": 9, "สิบ": 10,
     "1": 1, "2": 2, "3": 3, "4": 4, "5": 5,
     "6": 6, "7": 7, "8": 8, "9": 9, "10": 10,
-}
+})
 
 # ============ Pydantic Models ============
 class AddOn(BaseModel):
@@ -152,290 +223,445 @@ class MenuItemUpdate(BaseModel):
     category: Optional[str] = None
     is_active: Optional[bool] = None
 
+# Precompiled serializer for order items (stored as items_json)
+ORDER_ITEMS_TA = TypeAdapter(list[OrderItem])
+
 # ============ Database Setup ============
+_DB_CONN = None                # Shared connection (opened once, reused by every request)
+_DB_LOCK = threading.RLock()   # Serializes use of the shared connection across threads
+
 def get_db_connection():
-    """Get database connection with row factory"""
-    conn = sqlite3.connect(DATABASE_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """Get the shared database connection (WAL mode, row factory)"""
+    global _DB_CONN
+    if _DB_CONN is None:
+        conn = sqlite3.connect(DATABASE_PATH, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-64000")  # ~64 MB page cache
+        _DB_CONN = conn
+    return _DB_CONN
+
+@contextmanager
+def db_session():
+    """Use the shared connection exclusively for one unit of work (rolled back on error)"""
+    with _DB_LOCK:
+        conn = get_db_connection()
+        try:
+            yield conn
+        except Exception:
+            conn.rollback()
+            raise
+
+def close_db_connection():
+    """Close the shared connection (on shutdown)"""
+    global _DB_CONN
+    with _DB_LOCK:
+        if _DB_CONN is not None:
+            _DB_CONN.close()
+            _DB_CONN = None
 
 def init_database():
     """Initialize SQLite database for orders and menu"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Orders table (with status for kitchen display)
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS orders (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            items_json TEXT NOT NULL,
-            total_price INTEGER NOT NULL,
-            status TEXT DEFAULT 'pending',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-    
-    # Add status column if not exists (migration for existing DB)
-    try:
-        cursor.execute("ALTER TABLE orders ADD COLUMN status TEXT DEFAULT 'pending'")
+    with db_session() as conn:
+        cursor = conn.cursor()
+        
+        # Orders table (with status for kitchen display)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS orders (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                items_json TEXT NOT NULL,
+                total_price INTEGER NOT NULL,
+                status TEXT DEFAULT 'pending',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        
+        # Add status column if not exists (migration for existing DB)
+        try:
+            cursor.execute("ALTER TABLE orders ADD COLUMN status TEXT DEFAULT 'pending'")
+            conn.commit()
+        except sqlite3.OperationalError:
+            pass  # Column already exists
+        
+        # Menu items table
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS menu_items (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT UNIQUE NOT NULL,
+                keywords TEXT NOT NULL,
+                base_price INTEGER NOT NULL,
+                category TEXT DEFAULT 'standard',
+                is_active BOOLEAN DEFAULT 1,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        
         conn.commit()
-    except sqlite3.OperationalError:
-        pass  # Column already exists
-    
-    # Menu items table
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS menu_items (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT UNIQUE NOT NULL,
-            keywords TEXT NOT NULL,
-            base_price INTEGER NOT NULL,
-            category TEXT DEFAULT 'standard',
-            is_active BOOLEAN DEFAULT 1,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-    
-    conn.commit()
-    conn.close()
+        
+    reload_pending_orders()
+
+def reload_pending_orders():
+    """Load pending orders from database into memory (startup / cold start)"""
+    with db_session() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, items_json, total_price, created_at FROM orders WHERE status = 'pending' ORDER BY created_at, id")
+        rows = cursor.fetchall()
+        
+        with PENDING_LOCK:
+            PENDING_ORDERS.clear()
+            for row in rows:
+                PENDING_ORDERS[row["id"]] = {
+                    "id": row["id"],
+                    "items": orjson.loads(row["items_json"]),
+                    "total_price": row["total_price"],
+                    "created_at": row["created_at"]
+                }
 
 def seed_menu_if_empty():
     """Seed default menu items if table is empty"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute("SELECT COUNT(*) FROM menu_items")
-    count = cursor.fetchone()[0]
+    with db_session() as conn:
+        cursor = conn.cursor()
+        
+        cursor.execute("SELECT COUNT(*) FROM menu_items")
+        count = cursor.fetchone()[0]
+        
+        if count == 0:
+            logger.info("Seeding default menu items...")
+            for item in DEFAULT_MENU_ITEMS:
+                try:
+                    cursor.execute(
+                        "INSERT INTO menu_items (name, keywords, base_price, category) VALUES (?, ?, ?, ?)",
+                        (item["name"], item["keywords"], item["base_price"], item["category"])
+                    )
+                except sqlite3.IntegrityError:
+                    pass  # Skip duplicates
+            conn.commit()
+            logger.info("Seeded %d menu items", len(DEFAULT_MENU_ITEMS))
+
+def parse_keywords(raw: str) -> tuple:
+    """Split comma-separated keywords, dropping blanks. Interned so items sharing
+    a keyword (e.g. "หมู", "กะเพรา") share one string object."""
+    return tuple(sys.intern(k) for k in (part.strip() for part in raw.split(",")) if k)
+
+def build_keyword_index(items: list):
+    """Build keyword matcher: keyword -> (keyword, length, indices of items using it).
+    Aho-Corasick automaton if pyahocorasick is installed, otherwise a tuple of
+    (UTF-8 bytes, keyword, length, indices) sorted by keyword length (longest first)."""
+    postings = {}
+    for idx, item in enumerate(items):
+        for keyword in item["keywords"]:
+            postings.setdefault(keyword, []).append(idx)
     
-    if count == 0:
-        print("Seeding default menu items...")
-        for item in DEFAULT_MENU_ITEMS:
-            try:
-                cursor.execute(
-                    "INSERT INTO menu_items (name, keywords, base_price, category) VALUES (?, ?, ?, ?)",
-                    (item["name"], item["keywords"], item["base_price"], item["category"])
-                )
-            except sqlite3.IntegrityError:
-                pass  # Skip duplicates
-        conn.commit()
-        print(f"Seeded {len(DEFAULT_MENU_ITEMS)} menu items")
+    if ahocorasick is None:
+        return tuple(sorted(
+            ((keyword.encode("utf-8"), keyword, len(keyword), idxs) for keyword, idxs in postings.items()),
+            key=lambda entry: entry[2],
+            reverse=True
+        ))
     
-    conn.close()
+    automaton = ahocorasick.Automaton()
+    for keyword, idxs in postings.items():
+        automaton.add_word(keyword, (keyword, len(keyword), idxs))
+    automaton.make_automaton()
+    return automaton
 
 def reload_menu_cache():
     """Reload menu from database into cache"""
     global MENU_CACHE
     
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Load active items
-    cursor.execute("SELECT * FROM menu_items WHERE is_active = 1")
-    active_rows = cursor.fetchall()
-    
-    # Load inactive items (for sold-out detection)
-    cursor.execute("SELECT * FROM menu_items WHERE is_active = 0")
-    inactive_rows = cursor.fetchall()
-    
-    conn.close()
-    
-    items = []
-    inactive_items = []
-    keywords_map = {}
-    
-    for row in active_rows:
-        item = {
-            "id": row["id"],
-            "name": row["name"],
-            "keywords": row["keywords"].split(","),
-            "base_price": row["base_price"],
-            "category": row["category"]
-        }
-        items.append(item)
+    # Held across read, build and swap: two overlapping reloads (e.g. concurrent admin
+    # edits in the threadpool) can't finish out of order and publish the older snapshot
+    with _MENU_RELOAD_LOCK:
+        with db_session() as conn:
+            cursor = conn.cursor()
+            
+            # Load active items
+            cursor.execute("SELECT * FROM menu_items WHERE is_active = 1")
+            active_rows = cursor.fetchall()
+            
+            # Load inactive items (for sold-out detection)
+            cursor.execute("SELECT * FROM menu_items WHERE is_active = 0")
+            inactive_rows = cursor.fetchall()
         
-        # Build keyword map for fast lookup
-        for keyword in item["keywords"]:
-            keyword = keyword.strip()
-            if keyword:
-                if keyword not in keywords_map:
-                    keywords_map[keyword] = []
-                keywords_map[keyword].append(item)
-    
-    # Process inactive items for sold-out detection
-    for row in inactive_rows:
-        item = {
-            "id": row["id"],
-            "name": row["name"],
-            "keywords": row["keywords"].split(","),
-            "base_price": row["base_price"],
-            "category": row["category"]
+        items = []
+        inactive_items = []
+        
+        for row in active_rows:
+            item = {
+                "id": row["id"],
+                "name": row["name"],
+                "keywords": parse_keywords(row["keywords"]),
+                "base_price": row["base_price"],
+                "category": row["category"],
+                # Precomputed for build_order_item (fixed until next reload)
+                "gap_khao_name": row["name"].replace("ข้าว", "") + " (กับข้าว)",
+                "addons": tuple((n, p) for n, p in ADDONS_EXCLUDING_GAPKHAO if n not in row["name"])
+            }
+            items.append(item)
+        
+        # Process inactive items for sold-out detection
+        for row in inactive_rows:
+            item = {
+                "id": row["id"],
+                "name": row["name"],
+                "keywords": parse_keywords(row["keywords"]),
+                "base_price": row["base_price"],
+                "category": row["category"]
+            }
+            inactive_items.append(item)
+        
+        menu = {
+            "items": tuple(items),
+            "names": tuple(item["name"] for item in items),
+            "by_name": {normalize_text(item["name"]): item for item in items},
+            "inactive_by_name": {normalize_text(item["name"]): item for item in inactive_items},
+            "inactive_items": tuple(inactive_items),  # Store inactive items for sold-out check
+            "keyword_index": build_keyword_index(items),
+            "inactive_keyword_index": build_keyword_index(inactive_items),
+            "last_updated": datetime.now(THAI_TZ),
+            "version": MENU_CACHE["version"] + 1
         }
-        inactive_items.append(item)
-    
-    MENU_CACHE["items"] = items
-    MENU_CACHE["keywords_map"] = keywords_map
-    MENU_CACHE["inactive_items"] = inactive_items  # Store inactive items for sold-out check
-    MENU_CACHE["last_updated"] = datetime.now(THAI_TZ)
+        # The parse cache belongs to its snapshot, so a cached result is always built from this menu
+        menu["parse"] = functools.lru_cache(maxsize=2048)(functools.partial(_parse_transcript, menu))
+        
+        # Swap in a complete new cache at once: handlers running in the threadpool
+        # must never see items from one reload with the keyword index of another
+        MENU_CACHE = menu
     
-    print(f"Menu cache loaded: {len(items)} active, {len(inactive_items)} inactive items")
+    logger.info("Menu cache loaded: %d active, %d inactive items", len(items), len(inactive_items))
 
 # ============ Order Database Functions ============
+def save_orders_to_db(orders: list[tuple[list[OrderItem], int]]) -> list[int]:
+    """Save several orders in one transaction (single commit) and return their IDs"""
+    # Use Thai Time (UTC+7)
+    created_at = _fmt_ts(datetime.now(THAI_TZ))
+    rows = [(ORDER_ITEMS_TA.dump_json(items).decode(), total_price) for items, total_price in orders]
+    
+    with db_session() as conn:
+        cursor = conn.cursor()
+        order_ids = []
+        # One execute per row (executemany does not report each lastrowid); the commit is shared
+        for items_json, total_price in rows:
+            cursor.execute(
+                "INSERT INTO orders (items_json, total_price, status, created_at) VALUES (?, ?, 'pending', ?)",
+                (items_json, total_price, created_at)
+            )
+            order_ids.append(cursor.lastrowid)
+        conn.commit()
+        _bump_orders_version()
+        # Still under _DB_LOCK: the kitchen view changes together with the DB
+        with PENDING_LOCK:
+            for order_id, (items_json, total_price) in zip(order_ids, rows):
+                PENDING_ORDERS[order_id] = {
+                    "id": order_id,
+                    "items": orjson.loads(items_json),
+                    "total_price": total_price,
+                    "created_at": created_at
+                }
+    return order_ids
+
 def save_order_to_db(items: list[OrderItem], total_price: int) -> int:
     """Save order to database and return order ID"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    items_json = json.dumps([item.model_dump() for item in items], ensure_ascii=False)
-    
-    # Use Thai Time (UTC+7)
-    
-    # Use Thai Time (UTC+7)
-    created_at = datetime.now(THAI_TZ).strftime("%Y-%m-%d %H:%M:%S")
+    return save_orders_to_db([(items, total_price)])[0]
 
-    
-    cursor.execute(
-        "INSERT INTO orders (items_json, total_price, status, created_at) VALUES (?, ?, 'pending', ?)",
-        (items_json, total_price, created_at)
-    )
-    order_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
-    return order_id
+def _save_each_order(orders: list[tuple[list[OrderItem], int]]) -> list:
+    """Save orders one transaction each; returns the order ID or the raised exception per order"""
+    results = []
+    for items, total_price in orders:
+        try:
+            results.append(save_order_to_db(items, total_price))
+        except Exception as e:
+            results.append(e)
+    return results
 
-def get_pending_orders():
-    """Retrieve pending orders for kitchen display"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, items_json, total_price, created_at FROM orders WHERE status = 'pending' ORDER BY created_at DESC")
-    rows = cursor.fetchall()
-    conn.close()
-    return [
-        {
-            "id": row["id"],
-            "items": json.loads(row["items_json"]),
-            "total_price": row["total_price"],
-            "created_at": row["created_at"]
-        }
-        for row in rows
-    ]
+async def _commit_worker():
+    """Drain the commit queue, writing whatever has piled up as one batch"""
+    while True:
+        batch = [await _COMMIT_QUEUE.get()]
+        while len(batch) < COMMIT_BATCH_MAX and not _COMMIT_QUEUE.empty():
+            batch.append(_COMMIT_QUEUE.get_nowait())
+        
+        stop = any(entry is None for entry in batch)
+        batch = [entry for entry in batch if entry is not None and not entry[2].cancelled()]
+        if batch:
+            orders = [(items, total) for items, total, _ in batch]
+            try:
+                results = await asyncio.to_thread(save_orders_to_db, orders)
+            except Exception as e:
+                # The whole batch was rolled back: retry one by one so a single bad
+                # order fails alone instead of rejecting everyone batched with it
+                results = [e] if len(orders) == 1 else await asyncio.to_thread(_save_each_order, orders)
+            for (_, _, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+        if stop:
+            return
+
+async def enqueue_order(items: list[OrderItem], total_price: int) -> int:
+    """Save order via the group-commit queue (direct write if the worker isn't running)"""
+    if _COMMIT_QUEUE is None:
+        return await asyncio.to_thread(save_order_to_db, items, total_price)
+    future = asyncio.get_running_loop().create_future()
+    await _COMMIT_QUEUE.put((items, total_price, future))
+    return await future
+
+async def start_commit_worker():
+    """Start the group-commit background task (on startup)"""
+    global _COMMIT_QUEUE, _COMMIT_TASK
+    _COMMIT_QUEUE = asyncio.Queue()
+    _COMMIT_TASK = asyncio.create_task(_commit_worker())
+
+async def stop_commit_worker():
+    """Flush queued orders and stop the group-commit task (on shutdown)"""
+    global _COMMIT_QUEUE, _COMMIT_TASK
+    if _COMMIT_TASK is None:
+        return
+    await _COMMIT_QUEUE.put(None)
+    await _COMMIT_TASK
+    _COMMIT_QUEUE = _COMMIT_TASK = None
 
-def get_all_orders():
-    """Retrieve all orders from database (for analytics)"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, items_json, total_price, status, created_at FROM orders ORDER BY created_at DESC")
-    rows = cursor.fetchall()
-    conn.close()
-    return [
+def get_pending_orders():
+    """Retrieve pending orders for kitchen display (served from memory, newest first)"""
+    with PENDING_LOCK:
+        return list(PENDING_ORDERS.values())[::-1]
+
+@functools.lru_cache(maxsize=32)
+def _get_orders_page(limit: int, offset: int, orders_version: int) -> tuple:
+    """Load and decode one page of orders (cached until the next order write)"""
+    with db_session() as conn:
+        cursor = conn.cursor()
+        # id follows insertion order, so this walks the rowid instead of sorting by created_at
+        cursor.execute(
+            "SELECT id, items_json, total_price, status, created_at FROM orders ORDER BY id DESC LIMIT ? OFFSET ?",
+            (limit, offset)
+        )
+        rows = cursor.fetchall()
+    return tuple(
         {
             "id": row["id"],
-            "items": json.loads(row["items_json"]),
+            "items": orjson.loads(row["items_json"]),
             "total_price": row["total_price"],
             "status": row["status"],
             "created_at": row["created_at"]
         }
         for row in rows
-    ]
+    )
+
+def get_all_orders(limit: int = 200, offset: int = 0):
+    """Retrieve a page of orders from database, newest first (for analytics).
+    The list is new, but the order dicts (and their items) are shared with the page cache: read-only."""
+    return list(_get_orders_page(limit, offset, _ORDERS_VERSION))
 
 def complete_order(order_id: int):
     """Mark a single order as completed"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("UPDATE orders SET status = 'completed' WHERE id = ?", (order_id,))
-    updated = cursor.rowcount > 0
-    conn.commit()
-    conn.close()
+    with db_session() as conn:
+        cursor = conn.cursor()
+        cursor.execute("UPDATE orders SET status = 'completed' WHERE id = ?", (order_id,))
+        updated = cursor.rowcount > 0
+        conn.commit()
+        _bump_orders_version()
+        with PENDING_LOCK:
+            PENDING_ORDERS.pop(order_id, None)
     return updated
 
 def cancel_order(order_id: int):
     """Mark a single order as cancelled"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("UPDATE orders SET status = 'cancelled' WHERE id = ?", (order_id,))
-    updated = cursor.rowcount > 0
-    conn.commit()
-    conn.close()
+    with db_session() as conn:
+        cursor = conn.cursor()
+        cursor.execute("UPDATE orders SET status = 'cancelled' WHERE id = ?", (order_id,))
+        updated = cursor.rowcount > 0
+        conn.commit()
+        _bump_orders_version()
+        with PENDING_LOCK:
+            PENDING_ORDERS.pop(order_id, None)
     return updated
 
 
 def complete_all_pending_orders():
     """Mark all pending orders as completed (kitchen reset)"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("UPDATE orders SET status = 'completed' WHERE status = 'pending'")
-    count = cursor.rowcount
-    conn.commit()
-    conn.close()
+    with db_session() as conn:
+        cursor = conn.cursor()
+        cursor.execute("UPDATE orders SET status = 'completed' WHERE status = 'pending'")
+        count = cursor.rowcount
+        conn.commit()
+        _bump_orders_version()
+        with PENDING_LOCK:
+            PENDING_ORDERS.clear()
     return count
 
 def clear_all_orders():
     """Actually delete all orders (admin only)"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM orders")
-    conn.commit()
-    conn.close()
+    with db_session() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM orders")
+        conn.commit()
+        _bump_orders_version()
+        with PENDING_LOCK:
+            PENDING_ORDERS.clear()
 
 # ============ Menu Database Functions ============
 def get_all_menu_items():
     """Get all menu items from database"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM menu_items ORDER BY category, name")
-    rows = cursor.fetchall()
-    conn.close()
+    with db_session() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM menu_items ORDER BY category, name")
+        rows = cursor.fetchall()
     return [dict(row) for row in rows]
 
 def create_menu_item(item: MenuItemCreate):
     """Create a new menu item"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "INSERT INTO menu_items (name, keywords, base_price, category) VALUES (?, ?, ?, ?)",
-        (item.name, item.keywords, item.base_price, item.category)
-    )
-    item_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
+    with db_session() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT INTO menu_items (name, keywords, base_price, category) VALUES (?, ?, ?, ?)",
+            (item.name, item.keywords, item.base_price, item.category)
+        )
+        item_id = cursor.lastrowid
+        conn.commit()
     reload_menu_cache()  # Refresh cache
     return item_id
 
 def update_menu_item(item_id: int, updates: MenuItemUpdate):
     """Update a menu item"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Build dynamic update query
-    fields = []
-    values = []
-    for field, value in updates.model_dump(exclude_unset=True).items():
-        if value is not None:
-            fields.append(f"{field} = ?")
-            values.append(value)
-    
-    if not fields:
-        conn.close()
-        return False
-    
-    fields.append("updated_at = ?")
-    values.append(datetime.now(THAI_TZ).strftime("%Y-%m-%d %H:%M:%S"))
-
-    
-    query = f"UPDATE menu_items SET {', '.join(fields)} WHERE id = ?"
-    values.append(item_id)  # Add item_id for WHERE clause
-    cursor.execute(query, values)
-    conn.commit()
-    conn.close()
+    with db_session() as conn:
+        cursor = conn.cursor()
+        
+        # Build dynamic update query
+        fields = []
+        values = []
+        for field, value in updates.model_dump(exclude_unset=True).items():
+            if value is not None:
+                fields.append(f"{field} = ?")
+                values.append(value)
+        
+        if not fields:
+            return False
+        
+        fields.append("updated_at = ?")
+        values.append(_fmt_ts(datetime.now(THAI_TZ)))
+
+        
+        query = f"UPDATE menu_items SET {', '.join(fields)} WHERE id = ?"
+        values.append(item_id)  # Add item_id for WHERE clause
+        cursor.execute(query, values)
+        conn.commit()
     reload_menu_cache()  # Refresh cache
     return True
 
 def delete_menu_item(item_id: int):
     """Delete a menu item"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM menu_items WHERE id = ?", (item_id,))
-    deleted = cursor.rowcount > 0
-    conn.commit()
-    conn.close()
+    with db_session() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM menu_items WHERE id = ?", (item_id,))
+        deleted = cursor.rowcount > 0
+        conn.commit()
     if deleted:
         reload_menu_cache()  # Refresh cache
     return deleted
@@ -443,40 +669,38 @@ def delete_menu_item(item_id: int):
 # ============ Analytics Functions ============
 def get_analytics_summary():
     """Get sales analytics summary"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    now_thai = datetime.now(THAI_TZ)
-    today = now_thai.strftime("%Y-%m-%d")
-    week_ago = (now_thai - timedelta(days=7)).strftime("%Y-%m-%d")
-    month_ago = (now_thai - timedelta(days=30)).strftime("%Y-%m-%d")
-    
-    # Today's stats
-    cursor.execute("""
-        SELECT COUNT(*) as count, COALESCE(SUM(total_price), 0) as total
-        FROM orders WHERE DATE(created_at) = ?
-    """, (today,))
-    today_stats = dict(cursor.fetchone())
-    
-    # This week's stats
-    cursor.execute("""
-        SELECT COUNT(*) as count, COALESCE(SUM(total_price), 0) as total
-        FROM orders WHERE DATE(created_at) >= ?
-    """, (week_ago,))
-    week_stats = dict(cursor.fetchone())
-    
-    # This month's stats
-    cursor.execute("""
-        SELECT COUNT(*) as count, COALESCE(SUM(total_price), 0) as total
-        FROM orders WHERE DATE(created_at) >= ?
-    """, (month_ago,))
-    month_stats = dict(cursor.fetchone())
-    
-    # All time stats
-    cursor.execute("SELECT COUNT(*) as count, COALESCE(SUM(total_price), 0) as total FROM orders")
-    all_time_stats = dict(cursor.fetchone())
-    
-    conn.close()
+    with db_session() as conn:
+        cursor = conn.cursor()
+        
+        today_date = datetime.now(THAI_TZ).date()
+        today = _fmt_date(today_date)
+        week_ago = _fmt_date(today_date - timedelta(days=7))
+        month_ago = _fmt_date(today_date - timedelta(days=30))
+        
+        # Today's stats
+        cursor.execute("""
+            SELECT COUNT(*) as count, COALESCE(SUM(total_price), 0) as total
+            FROM orders WHERE DATE(created_at) = ?
+        """, (today,))
+        today_stats = dict(cursor.fetchone())
+        
+        # This week's stats
+        cursor.execute("""
+            SELECT COUNT(*) as count, COALESCE(SUM(total_price), 0) as total
+            FROM orders WHERE DATE(created_at) >= ?
+        """, (week_ago,))
+        week_stats = dict(cursor.fetchone())
+        
+        # This month's stats
+        cursor.execute("""
+            SELECT COUNT(*) as count, COALESCE(SUM(total_price), 0) as total
+            FROM orders WHERE DATE(created_at) >= ?
+        """, (month_ago,))
+        month_stats = dict(cursor.fetchone())
+        
+        # All time stats
+        cursor.execute("SELECT COUNT(*) as count, COALESCE(SUM(total_price), 0) as total FROM orders")
+        all_time_stats = dict(cursor.fetchone())
     
     return {
         "today": today_stats,
@@ -487,18 +711,17 @@ def get_analytics_summary():
 
 def get_top_items(limit: int = 10):
     """Get top selling menu items"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT items_json FROM orders")
-    rows = cursor.fetchall()
-    conn.close()
-    
+    with db_session() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT items_json FROM orders")
+        rows = cursor.fetchall()
+        
     # Count menu items
     item_counts = {}
     item_revenue = {}
     
     for row in rows:
-        items = json.loads(row["items_json"])
+        items = orjson.loads(row["items_json"])
         for item in items:
             name = item.get("menu_name", "Unknown")
             qty = item.get("quantity", 1)
@@ -517,65 +740,69 @@ def get_top_items(limit: int = 10):
 
 def get_daily_sales(days: int = 7):
     """Get daily sales for the past N days"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
+    with db_session() as conn:
+        cursor = conn.cursor()
+
+        today_date = datetime.now(THAI_TZ).date()
+        start = _fmt_date(today_date - timedelta(days=days - 1))
+
+        # Single grouped query instead of one query per day
+        cursor.execute("""
+            SELECT DATE(created_at) as d, COUNT(*) as count, COALESCE(SUM(total_price), 0) as total
+            FROM orders WHERE DATE(created_at) >= ?
+            GROUP BY d
+        """, (start,))
+        by_date = {row["d"]: row for row in cursor.fetchall()}
+
+    # Fill in days without orders with zeros
     results = []
-    now_thai = datetime.now(THAI_TZ)
     for i in range(days - 1, -1, -1):
-        date = (now_thai - timedelta(days=i)).strftime("%Y-%m-%d")
-        cursor.execute("""
-            SELECT COUNT(*) as count, COALESCE(SUM(total_price), 0) as total
-            FROM orders WHERE DATE(created_at) = ?
-        """, (date,))
-        row = dict(cursor.fetchone())
+        date = _fmt_date(today_date - timedelta(days=i))
+        row = by_date.get(date)
         results.append({
             "date": date,
-            "orders": row["count"],
-            "revenue": row["total"]
+            "orders": row["count"] if row else 0,
+            "revenue": row["total"] if row else 0
         })
-    
-    conn.close()
+
     return results
 
 def get_order_statistics(days: int = 7):
     """Get order counts by status for the past N days"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    if days >= 365:
-        date_filter = ""
-        params = ()
-    else:
-        date_filter = "WHERE DATE(created_at) >= ?"
-        cutoff_date = (datetime.now(THAI_TZ) - timedelta(days=days)).strftime("%Y-%m-%d")
-        params = (cutoff_date,)
-    
-    # Total orders
-    cursor.execute(f"SELECT COUNT(*) FROM orders {date_filter}", params)
-    total = cursor.fetchone()[0]
-    
-    # Pending orders
-    filter_with_status = f"{date_filter} {'AND' if date_filter else 'WHERE'} status = 'pending'"
-    cursor.execute(f"SELECT COUNT(*) FROM orders {filter_with_status.replace('WHERE AND', 'WHERE')}", params)
-    pending = cursor.fetchone()[0]
-    
-    # Completed orders
-    filter_with_status = f"{date_filter} {'AND' if date_filter else 'WHERE'} status = 'completed'"
-    cursor.execute(f"SELECT COUNT(*) FROM orders {filter_with_status.replace('WHERE AND', 'WHERE')}", params)
-    completed = cursor.fetchone()[0]
-    
-    # Cancelled orders
-    filter_with_status = f"{date_filter} {'AND' if date_filter else 'WHERE'} status = 'cancelled'"
-    cursor.execute(f"SELECT COUNT(*) FROM orders {filter_with_status.replace('WHERE AND', 'WHERE')}", params)
-    cancelled = cursor.fetchone()[0]
-    
-    # Revenue (from completed orders only)
-    filter_with_status = f"{date_filter} {'AND' if date_filter else 'WHERE'} status = 'completed'"
-    cursor.execute(f"SELECT COALESCE(SUM(total_price), 0) FROM orders {filter_with_status.replace('WHERE AND', 'WHERE')}", params)
-    revenue = cursor.fetchone()[0]
-    
-    conn.close()
+    with db_session() as conn:
+        cursor = conn.cursor()
+        
+        if days >= 365:
+            date_filter = ""
+            params = ()
+        else:
+            date_filter = "WHERE DATE(created_at) >= ?"
+            cutoff_date = _fmt_date(datetime.now(THAI_TZ).date() - timedelta(days=days))
+            params = (cutoff_date,)
+        
+        # Total orders
+        cursor.execute(f"SELECT COUNT(*) FROM orders {date_filter}", params)
+        total = cursor.fetchone()[0]
+        
+        # Pending orders
+        filter_with_status = f"{date_filter} {'AND' if date_filter else 'WHERE'} status = 'pending'"
+        cursor.execute(f"SELECT COUNT(*) FROM orders {filter_with_status.replace('WHERE AND', 'WHERE')}", params)
+        pending = cursor.fetchone()[0]
+        
+        # Completed orders
+        filter_with_status = f"{date_filter} {'AND' if date_filter else 'WHERE'} status = 'completed'"
+        cursor.execute(f"SELECT COUNT(*) FROM orders {filter_with_status.replace('WHERE AND', 'WHERE')}", params)
+        completed = cursor.fetchone()[0]
+        
+        # Cancelled orders
+        filter_with_status = f"{date_filter} {'AND' if date_filter else 'WHERE'} status = 'cancelled'"
+        cursor.execute(f"SELECT COUNT(*) FROM orders {filter_with_status.replace('WHERE AND', 'WHERE')}", params)
+        cancelled = cursor.fetchone()[0]
+        
+        # Revenue (from completed orders only)
+        filter_with_status = f"{date_filter} {'AND' if date_filter else 'WHERE'} status = 'completed'"
+        cursor.execute(f"SELECT COALESCE(SUM(total_price), 0) FROM orders {filter_with_status.replace('WHERE AND', 'WHERE')}", params)
+        revenue = cursor.fetchone()[0]
     
     return {
         "total": total,
@@ -587,149 +814,215 @@ def get_order_statistics(days: int = 7):
 
 
 # ============ Order Parsing (using cache) ============
-def process_order(transcript: str) -> Optional[OrderItem]:
-    """Parse order using cached menu data (note is added separately via frontend)"""
-    
-    clean_text = transcript.replace("เอา", "").replace("ขอ", "").strip()
-    
-    candidates = []
+@dataclass(slots=True)
+class TranscriptCtx:
+    """Transcript normalized once per request and shared by all scorers"""
+    raw: str    # Original transcript (used for add-on detection)
+    clean: str  # Without filler words (used for keyword scoring)
+
+def normalize_text(text: str) -> str:
+    """Strip filler words (FILLER_RE); shared by transcripts and exact-name lookup keys"""
+    return FILLER_RE.sub("", text).strip()
+
+def make_transcript_ctx(transcript: str) -> TranscriptCtx:
+    """Normalize transcript once for the whole request"""
+    return TranscriptCtx(raw=transcript, clean=normalize_text(transcript))
+
+def score_items(clean_text: str, keyword_index, n_items: int, weight: int = 1) -> list[int]:
+    """Score items by matched keywords (index from build_keyword_index).
+    Each distinct keyword counts once (len(keyword) * weight) for every item that uses it."""
+    scores = [0] * n_items
+    if keyword_index is None:
+        return scores
+    
+    if ahocorasick is None:
+        # Bytes-level search: one encode, then C-level find per unique keyword
+        clean_bytes = clean_text.encode("utf-8")
+        for keyword_bytes, _, keyword_len, idxs in keyword_index:
+            if clean_bytes.find(keyword_bytes) >= 0:
+                for idx in idxs:
+                    scores[idx] += keyword_len * weight
+        return scores
+    
+    if keyword_index.kind != ahocorasick.AHOCORASICK:
+        return scores  # No keywords
+    
+    seen = set()
+    for _, (keyword, keyword_len, idxs) in keyword_index.iter(clean_text):
+        if keyword in seen:
+            continue
+        seen.add(keyword)
+        for idx in idxs:
+            scores[idx] += keyword_len * weight  # Longer matches score higher
+    return scores
+
+
+@dataclass(slots=True)
+class MenuScore:
+    """Best keyword matches of one transcript over active and inactive items"""
+    active_score: int               # Best score among active items
+    best_active: Optional[dict]     # First active item with that score
+    ambiguous: bool                 # Another active item ties the best score
+    inactive_score: int             # Best score among inactive (sold-out) items
+    best_inactive: Optional[dict]   # First inactive item with that score
+
+def score_menu(ctx: TranscriptCtx, menu: dict) -> MenuScore:
+    """Score active and inactive items of one menu snapshot, for both sold-out check and matching"""
+    items = menu["items"]
+    scores = score_items(ctx.clean, menu["keyword_index"], len(items))
+    
+    # Single-pass argmax; ambiguity only needs to know about a tie, not every tied item
     best_score = 0
-    
-    # Score each menu item by keyword matches
-    for item in MENU_CACHE["items"]:
-        score = 0
-        for keyword in item["keywords"]:
-            if keyword in clean_text:
-                score += len(keyword)  # Longer matches score higher
-        
+    best_idx = -1
+    tie = False
+    for idx, score in enumerate(scores):
         if score > best_score:
             best_score = score
-            candidates = [item]
+            best_idx = idx
+            tie = False
         elif score == best_score and score > 0:
-            candidates.append(item)
+            tie = True
     
+    best_inactive_score = 0
+    best_inactive_match = None
+    inactive_items = menu.get("inactive_items", ())
+    if inactive_items:
+        inactive_scores = score_items(ctx.clean, menu["inactive_keyword_index"], len(inactive_items))
+        for item, score in zip(inactive_items, inactive_scores):
+            if score > best_inactive_score:
+                best_inactive_score = score
+                best_inactive_match = item
+    
+    return MenuScore(
+        active_score=best_score,
+        best_active=items[best_idx] if best_idx >= 0 else None,
+        ambiguous=tie,
+        inactive_score=best_inactive_score,
+        best_inactive=best_inactive_match
+    )
+
+
+def process_order(ctx: TranscriptCtx, menu_score: MenuScore) -> Optional[OrderItem]:
+    """Parse order using cached menu data (note is added separately via frontend)"""
     # Ambiguity check: if multiple items have the COMPETING best score, return None to trigger suggestions
     # Exception: if they are identical name (duplicate) or very obvious logic overrides
-    if len(candidates) > 1:
+    if menu_score.ambiguous:
         return None
 
-    if len(candidates) == 1:
-        best_match = candidates[0]
-        # Check Add-ons
-        add_ons = []
-        is_gap_khao = False
-        
-        if "กับข้าว" in transcript:
-            is_gap_khao = True
-            add_ons.append(AddOn(name="กับข้าว", price=ADD_ONS["กับข้าว"]["price"], selected=True))
-        
-        for addon_name, addon_info in ADD_ONS.items():
-            if addon_name == "กับข้าว":
-                continue
-            if addon_name in transcript and addon_name not in best_match["name"]:
-                add_ons.append(AddOn(name=addon_name, price=addon_info["price"], selected=True))
-        
-        # Calculate total
-        menu_name = best_match["name"]
-        base_price = best_match["base_price"]
-        
-        if is_gap_khao:
-            menu_name = menu_name.replace("ข้าว", "") + " (กับข้าว)"
-        
-        total = base_price + sum(a.price for a in add_ons)
-        
-        # Note is None - will be added separately via frontend
-        return OrderItem(menu_name=menu_name, quantity=1, price=total, add_ons=add_ons, note=None)
+    if menu_score.best_active:
+        return build_order_item(menu_score.best_active, ctx.raw)
     
     return None
 
 
-def get_suggestions(transcript: str, limit: int = 10) -> list[str]:
-    """Find menu suggestions based on keyword scoring and fuzzy matching"""
-    clean_text = transcript.replace("เอา", "").replace("ขอ", "").strip()
+def build_order_item(best_match: dict, transcript: str) -> OrderItem:
+    """Build order item for a matched menu item, detecting add-ons in the transcript"""
+    # Check Add-ons
+    add_ons = []
+    addon_total = 0
+    found = set(ADDON_RE.findall(transcript))
+    is_gap_khao = "กับข้าว" in found
+    
+    if is_gap_khao:
+        add_ons.append(AddOn(name="กับข้าว", price=GAP_KHAO_PRICE, selected=True))
+        addon_total += GAP_KHAO_PRICE
+    
+    # Add-ons not already part of the dish name (e.g. no extra ไข่ดาว for ข้าวไข่ดาว)
+    for addon_name, addon_price in best_match["addons"]:
+        if addon_name in found:
+            add_ons.append(AddOn(name=addon_name, price=addon_price, selected=True))
+            addon_total += addon_price
+    
+    # Calculate total
+    menu_name = best_match["gap_khao_name"] if is_gap_khao else best_match["name"]
+    total = best_match["base_price"] + addon_total
+    
+    # Note is None - will be added separately via frontend
+    return OrderItem(menu_name=menu_name, quantity=1, price=total, add_ons=add_ons, note=None)
+
+
+def get_suggestions(ctx: TranscriptCtx, menu: dict, limit: int = 10) -> list[str]:
+    """Find menu suggestions (from one menu snapshot) based on keyword scoring and fuzzy matching"""
+    clean_text = ctx.clean
     if not clean_text:
         return []
 
     # 1. Weighted Keyword Scoring
-    scored_items = []
-    
-    for item in MENU_CACHE["items"]:
-        score = 0
-        for keyword in item["keywords"]:
-            if keyword in clean_text:
-                score += len(keyword) * 2 # Give higher weight to matches
-        
-        if score > 0:
-            scored_items.append((score, item["name"]))
+    items = menu["items"]
+    scores = score_items(clean_text, menu["keyword_index"], len(items), weight=2)  # Give higher weight to matches
+    scored_items = [(score, item["name"]) for item, score in zip(items, scores) if score > 0]
             
-    # Sort by score descending
-    scored_items.sort(key=lambda x: x[0], reverse=True)
-    suggestions = [x[1] for x in scored_items]
+    # Keep only the top `limit` by score (no need to sort every match)
+    top_items = heapq.nlargest(limit, scored_items, key=lambda x: x[0])
+    suggestions = [x[1] for x in top_items]
     
     # 2. Fallback to fuzzy matching if we need more suggestions
     if len(suggestions) < limit:
-        all_names = [item["name"] for item in MENU_CACHE["items"]]
         # Remove already found
-        candidates = [n for n in all_names if n not in suggestions]
+        found = set(suggestions)
+        candidates = [n for n in menu["names"] if n not in found]
         
-        matches = difflib.get_close_matches(clean_text, candidates, n=limit - len(suggestions), cutoff=0.3)
-        suggestions.extend(matches)
+        # fuzz.ratio (Indel distance) approximates difflib's Ratcliff/Obershelp ratio at the
+        # old 0.3 cutoff; scores can differ slightly and ties come back in a different order
+        matches = process.extract(clean_text, candidates, scorer=fuzz.ratio, limit=limit - len(suggestions), score_cutoff=30)
+        suggestions.extend(name for name, _, _ in matches)
             
     return suggestions[:limit]
 
 
-def check_sold_out(transcript: str) -> Optional[str]:
+def check_sold_out(menu_score: MenuScore) -> Optional[str]:
     """Check if the order matches any inactive (sold-out) menu item.
     Only returns sold-out if inactive item has HIGHER score than any active item.
     This prevents false positives like 'กระเพราหมูกรอบหมด' when ordering 'กระเพราหมู'."""
-    clean_text = transcript.replace("เอา", "").replace("ขอ", "").strip()
-    
-    inactive_items = MENU_CACHE.get("inactive_items", [])
-    active_items = MENU_CACHE.get("items", [])
-    
-    if not inactive_items:
-        return None
-    
-    # Calculate best score for INACTIVE items
-    best_inactive_score = 0
-    best_inactive_match = None
-    
-    for item in inactive_items:
-        score = 0
-        for keyword in item["keywords"]:
-            keyword = keyword.strip()
-            if keyword and keyword in clean_text:
-                score += len(keyword)
-        
-        if score > best_inactive_score:
-            best_inactive_score = score
-            best_inactive_match = item
-    
     # No inactive match at all
-    if not best_inactive_match or best_inactive_score == 0:
+    if not menu_score.best_inactive or menu_score.inactive_score == 0:
         return None
     
-    # Calculate best score for ACTIVE items
-    best_active_score = 0
-    
-    for item in active_items:
-        score = 0
-        for keyword in item["keywords"]:
-            keyword = keyword.strip()
-            if keyword and keyword in clean_text:
-                score += len(keyword)
-        
-        if score > best_active_score:
-            best_active_score = score
-    
     # Only return sold-out if inactive score is STRICTLY HIGHER than active score
     # This means user is specifically ordering the sold-out item, not a similar one
-    if best_inactive_score > best_active_score:
-        return best_inactive_match["name"]
+    if menu_score.inactive_score > menu_score.active_score:
+        return menu_score.best_inactive["name"]
     
     return None
 
 
+@dataclass(frozen=True, slots=True)
+class ParseResult:
+    """Outcome of parsing one transcript against the menu"""
+    sold_out_item: Optional[str]
+    item: Optional[OrderItem]
+    suggestions: tuple[str, ...]
+
+def _parse_transcript(menu: dict, transcript: str) -> ParseResult:
+    """Parse transcript against one menu snapshot (sold-out check, match, suggestions).
+    Memoized per snapshot as menu["parse"] by reload_menu_cache."""
+    ctx = make_transcript_ctx(transcript)
+    
+    # Fast path: transcript is exactly a menu name (e.g. a tapped suggestion)
+    exact = menu["by_name"].get(ctx.clean)
+    if exact:
+        return ParseResult(sold_out_item=None, item=build_order_item(exact, ctx.raw), suggestions=())
+    exact_inactive = menu["inactive_by_name"].get(ctx.clean)
+    if exact_inactive:
+        return ParseResult(sold_out_item=exact_inactive["name"], item=None, suggestions=())
+    
+    # Score once: shared by sold-out check and matching
+    menu_score = score_menu(ctx, menu)
+    
+    # Check for sold-out items FIRST
+    sold_out_item = check_sold_out(menu_score)
+    if sold_out_item:
+        return ParseResult(sold_out_item=sold_out_item, item=None, suggestions=())
+    
+    item = process_order(ctx, menu_score)
+    suggestions = () if item else tuple(get_suggestions(ctx, menu))
+    return ParseResult(sold_out_item=None, item=item, suggestions=suggestions)
+
+def parse_transcript(transcript: str) -> ParseResult:
+    """Parse transcript against the current menu snapshot (memoized per snapshot)"""
+    return MENU_CACHE["parse"](transcript)
+
+
 # ============ FastAPI App ============
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -737,23 +1030,28 @@ async def lifespan(app: FastAPI):
     init_database()
     seed_menu_if_empty()
     reload_menu_cache()
-    print("Server ready!")
+    await start_commit_worker()
+    logger.info("Server ready!")
     yield
+    await stop_commit_worker()
+    close_db_connection()
 
 app = FastAPI(
     title="Voice Order API",
     description="Thai Voice-Controlled Ordering System for Rice & Curry Shop",
     version="2.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
-# CORS configuration for frontend access
+# CORS configuration for frontend access (any origin: the UI is opened via LAN IPs too)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET", "POST", "PUT", "DELETE"],
+    allow_headers=["Content-Type"],
+    max_age=86400,  # Browsers cache preflight responses for 24h
 )
 
 # ============ Health Check ============
@@ -763,63 +1061,75 @@ async def health_check():
     return {"status": "ok", "message": "Voice Order API is running", "version": "2.0.0"}
 
 # ============ Order Endpoints ============
+# Handlers that touch SQLite are plain `def`: FastAPI runs them in its threadpool
+# so blocking DB calls never stall /process-text-order on the event loop
 class TextOrderRequest(BaseModel):
     transcript: str
 
+def order_response(success: bool, transcript: Optional[str] = None, item: Optional[OrderItem] = None,
+                   error: Optional[str] = None, suggestions: tuple[str, ...] = ()) -> ORJSONResponse:
+    """Build OrderResponse payload as a plain dict (skips response-model validation)"""
+    return ORJSONResponse({
+        "success": success,
+        "transcript": transcript,
+        "items": [item.model_dump()] if item else [],
+        "total_price": (item.price or 0) if item else 0,
+        "error": error,
+        "suggestions": suggestions
+    })
+
+# response_model documents the payload; returning ORJSONResponse directly bypasses its validation
 @app.post("/process-text-order", response_model=OrderResponse)
 async def process_text_order(request: TextOrderRequest):
     """Process order from text (from Web Speech API)"""
     try:
         transcript = request.transcript.strip()
-        print(f"Processing text order: {transcript}")
+        logger.info("Processing text order: %s", transcript)
         
         if not transcript:
-            return OrderResponse(success=False, error="ไม่มีข้อความที่จะประมวลผล")
+            return order_response(success=False, error="ไม่มีข้อความที่จะประมวลผล")
+        
+        result = parse_transcript(transcript)
         
         # Check for sold-out items FIRST
-        sold_out_item = check_sold_out(transcript)
+        sold_out_item = result.sold_out_item
         if sold_out_item:
-            print(f"Item sold out: {sold_out_item}")
-            return OrderResponse(
+            logger.info("Item sold out: %s", sold_out_item)
+            return order_response(
                 success=False,
                 transcript=transcript,
                 error=f"❌ {sold_out_item} หมดแล้วครับ",
-                suggestions=[]  # Don't suggest alternatives for sold-out items
+                suggestions=()  # Don't suggest alternatives for sold-out items
             )
         
-        item = process_order(transcript)
-        print(f"Found item: {item.menu_name if item else 'None'}")
+        item = result.item
+        logger.info("Found item: %s", item.menu_name if item else None)
         
         if not item:
             # Try to get suggestions
-            suggestions = get_suggestions(transcript)
+            suggestions = result.suggestions
             error_msg = "ไม่พบรายการอาหารในคำสั่ง"
             if suggestions:
                 error_msg = "ไม่พบรายการอาหารที่ระบุ แต่มีรายการที่ใกล้เคียง..."
 
-            return OrderResponse(
+            return order_response(
                 success=False,
                 transcript=transcript,
                 error=error_msg,
                 suggestions=suggestions
             )
         
-        return OrderResponse(
-            success=True,
-            transcript=transcript,
-            items=[item],
-            total_price=item.price or 0
-        )
+        return order_response(success=True, transcript=transcript, item=item)
         
     except Exception as e:
-        print(f"Error processing text order: {e}")
-        return OrderResponse(success=False, error=f"เกิดข้อผิดพลาด: {str(e)}")
+        logger.error("Error processing text order: %s", e)
+        return order_response(success=False, error=f"เกิดข้อผิดพลาด: {str(e)}")
 
-@app.post("/confirm-order", response_model=ConfirmOrderResponse)
+@app.post("/confirm-order", response_model=ConfirmOrderResponse, response_model_exclude_none=True)
 async def confirm_order(request: ConfirmOrderRequest):
-    """Save confirmed order to database"""
+    """Save confirmed order to database (batched with concurrent confirmations)"""
     try:
-        order_id = save_order_to_db(request.items, request.total_price)
+        order_id = await enqueue_order(request.items, request.total_price)
         return ConfirmOrderResponse(
             success=True,
             order_id=order_id,
@@ -829,10 +1139,10 @@ async def confirm_order(request: ConfirmOrderRequest):
         return ConfirmOrderResponse(success=False, message=f"เกิดข้อผิดพลาด: {str(e)}")
 
 @app.get("/orders")
-async def list_orders():
-    """Get all orders (for analytics/admin)"""
+def list_orders(limit: int = Query(200, ge=1, le=1000), offset: int = Query(0, ge=0)):
+    """Get orders page by page (for analytics/admin)"""
     try:
-        orders = get_all_orders()
+        orders = get_all_orders(limit, offset)
         return {"success": True, "orders": orders}
     except Exception as e:
         return {"success": False, "error": str(e)}
@@ -847,7 +1157,7 @@ async def list_pending_orders():
         return {"success": False, "error": str(e)}
 
 @app.post("/orders/{order_id}/complete")
-async def mark_order_complete(order_id: int):
+def mark_order_complete(order_id: int):
     """Mark a single order as completed"""
     try:
         success = complete_order(order_id)
@@ -858,7 +1168,7 @@ async def mark_order_complete(order_id: int):
         return {"success": False, "error": str(e)}
 
 @app.post("/orders/{order_id}/cancel")
-async def mark_order_cancelled(order_id: int):
+def mark_order_cancelled(order_id: int):
     """Mark a single order as cancelled"""
     try:
         success = cancel_order(order_id)
@@ -870,7 +1180,7 @@ async def mark_order_cancelled(order_id: int):
 
 
 @app.delete("/orders")
-async def complete_all_orders():
+def complete_all_orders():
     """Mark all pending orders as completed (kitchen reset - data preserved for analytics)"""
     try:
         count = complete_all_pending_orders()
@@ -879,7 +1189,7 @@ async def complete_all_orders():
         return {"success": False, "error": str(e)}
 
 @app.delete("/orders/delete-all")
-async def delete_all_orders():
+def delete_all_orders():
     """Actually delete all orders (admin only - use with caution)"""
     try:
         clear_all_orders()
@@ -889,7 +1199,7 @@ async def delete_all_orders():
 
 # ============ Menu Management Endpoints ============
 @app.get("/menu-items")
-async def list_menu_items():
+def list_menu_items():
     """Get all menu items"""
     try:
         items = get_all_menu_items()
@@ -898,7 +1208,7 @@ async def list_menu_items():
         return {"success": False, "error": str(e)}
 
 @app.post("/menu-items")
-async def add_menu_item(item: MenuItemCreate):
+def add_menu_item(item: MenuItemCreate):
     """Add a new menu item"""
     try:
         item_id = create_menu_item(item)
@@ -909,7 +1219,7 @@ async def add_menu_item(item: MenuItemCreate):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.put("/menu-items/{item_id}")
-async def edit_menu_item(item_id: int, updates: MenuItemUpdate):
+def edit_menu_item(item_id: int, updates: MenuItemUpdate):
     """Update a menu item"""
     try:
         success = update_menu_item(item_id, updates)
@@ -920,7 +1230,7 @@ async def edit_menu_item(item_id: int, updates: MenuItemUpdate):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.delete("/menu-items/{item_id}")
-async def remove_menu_item(item_id: int):
+def remove_menu_item(item_id: int):
     """Delete a menu item"""
     try:
         success = delete_menu_item(item_id)
@@ -931,7 +1241,7 @@ async def remove_menu_item(item_id: int):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/menu-cache/reload")
-async def refresh_cache():
+def refresh_cache():
     """Manually reload menu cache"""
     try:
         reload_menu_cache()
@@ -946,7 +1256,7 @@ async def refresh_cache():
 
 # ============ Analytics Endpoints ============
 @app.get("/analytics/summary")
-async def get_summary():
+def get_summary():
     """Get sales summary analytics"""
     try:
         summary = get_analytics_summary()
@@ -955,7 +1265,7 @@ async def get_summary():
         return {"success": False, "error": str(e)}
 
 @app.get("/analytics/top-items")
-async def get_top_selling(limit: int = 10):
+def get_top_selling(limit: int = 10):
     """Get top selling items"""
     try:
         items = get_top_items(limit)
@@ -964,7 +1274,7 @@ async def get_top_selling(limit: int = 10):
         return {"success": False, "error": str(e)}
 
 @app.get("/analytics/daily-sales")
-async def get_daily(days: int = 7):
+def get_daily(days: int = 7):
     """Get daily sales data"""
     try:
         data = get_daily_sales(days)
@@ -973,7 +1283,7 @@ async def get_daily(days: int = 7):
         return {"success": False, "error": str(e)}
 
 @app.get("/analytics/order-stats")
-async def get_order_stats(days: int = 7):
+def get_order_stats(days: int = 7):
     """Get order statistics by status"""
     try:
         stats = get_order_statistics(days)
@@ -119,14 +119,19 @@ export default function DashboardPage() {
         }
     };
 
-    // Fetch all orders
+    // Fetch all orders (the API returns them page by page, newest first)
     const fetchOrders = async () => {
+        const pageSize = 1000;
         try {
-            const res = await fetch(`${BACKEND_URL}/orders`);
-            const data = await res.json();
-            if (data.success) {
-                setOrders(data.orders);
+            let allOrders: Order[] = [];
+            for (let offset = 0; ; offset += pageSize) {
+                const res = await fetch(`${BACKEND_URL}/orders?limit=${pageSize}&offset=${offset}`);
+                const data = await res.json();
+                if (!data.success) return;
+                allOrders = allOrders.concat(data.orders);
+                if (data.orders.length < pageSize) break;
             }
+            setOrders(allOrders);
         } catch (error) {
             console.error("Error fetching orders:", error);
         }